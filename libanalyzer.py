@@ -1,6 +1,28 @@
 from urllib.parse import ParseResult, urlparse
+import functools
 import sys
 
+_urlparse_cached = functools.lru_cache(maxsize=8192)(urlparse)
+
+FIREFOX_UA = sys.intern("Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:67.0) Gecko/20100101 Firefox/67.0")
+CHROME_UA = sys.intern("Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) "
+            "Chrome/77.0.3865.75 Safari/537.36")
+SAFARI_UA = sys.intern("Mozilla/5.0 (Macintosh; Intel Mac OS X 10_14_4) AppleWebKit/605.1.15 (KHTML, like Gecko) "
+            "Version/12.1 Safari/605.1.15")
+SAFARI_IOS_UA = sys.intern("Mozilla/5.0 (iPhone; CPU iPhone OS 12_4 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) "
+                "Version/12.1.2 Mobile/15E148 Safari/604.1")
+SAMSUNG_UA = sys.intern("Mozilla/5.0 (Linux; Android 9; SAMSUNG SM-G960U Build/PPR1.180610.011) AppleWebKit/537.36 "
+             "(KHTML, like Gecko) SamsungBrowser/9.4 Chrome/67.0.3396.87 Mobile Safari/537.36")
+UC_UA = sys.intern("Mozilla/5.0 (Linux; U; Android 7.0; es-LA; Moto C Build/NRD90M.068) AppleWebKit/537.36 "
+        "(KHTML, like Gecko) Version/4.0 Chrome/57.0.2987.108 UCBrowser/12.9.5.1146 Mobile Safari/537.36")
+IE_UA = sys.intern("Mozilla/5.0 (Windows NT 6.1; WOW64; Trident/7.0; rv:11.0) like Gecko")
+OPERA_MINI_UA = sys.intern("Opera/9.80 (Android; Opera Mini/12.0.1987/37.7327; U; pl) Presto/2.12.423 Version/12.16")
+EDGE_UA = sys.intern("Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) "
+          "Chrome/64.0.3282.140 Safari/537.36 Edge/18.17763")
+
+# Sentinel recorded during crawling when a header was not present
+NO_HEADER = sys.intern('WARN_NO_HEADER')
+
 
 def is_valid_origin(uo: ParseResult) -> bool:
     """
@@ -9,14 +31,11 @@ def is_valid_origin(uo: ParseResult) -> bool:
     :param uo: ParseResult returned by urlparse of the current URL
     :return: true if URL is valid else false
     """
-    try:
-        valid_scheme = uo.scheme == 'http' or uo.scheme == 'https'
-        valid_hostname = uo.hostname != '' and (not uo.hostname.startswith("*."))
-        return valid_scheme and valid_hostname
-    except Exception as e:
-        print("!!! is_valid_origin failed on:", str(uo))
-        print(e)
+    if uo.scheme != 'http' and uo.scheme != 'https':
         return False
+    # hostname is None for netloc-less URLs, which the old except path rejected
+    host = uo.hostname
+    return host is not None and host != '' and (not host.startswith("*."))
 
 
 def parse_xfo(s: str) -> str or None:
@@ -24,11 +43,50 @@ def parse_xfo(s: str) -> str or None:
     :param s: Raw XFO header value as string
     :return: Stripped string or None
     """
-    if s == 'WARN_NO_HEADER':
+    if s == NO_HEADER:
         return None
     return s.strip()
 
 
+def _iter_xfo_tokens(headers: list):
+    """
+    Yields the stripped tokens of comma-separated XFO headers in one pass
+
+    :param headers: Raw XFO header values
+    :return: Generator of non-empty stripped tokens
+    """
+    for h in headers:
+        if h == NO_HEADER:
+            continue
+        for tok in h.split(','):
+            tok = tok.strip()
+            if tok:
+                yield tok
+
+
+def _parse_origin(o: str) -> ParseResult:
+    """
+    Parses the accessed URL once, fixing up scheme-relative URLs first
+
+    :param o: Original accessed URL
+    :return: ParseResult of the URL
+    """
+    if o is not None and o.startswith('//'):
+        o = 'https:' + o
+    return _urlparse_cached(o)
+
+
+@functools.lru_cache(maxsize=8192)
+def _origin_pair(uo: ParseResult) -> tuple:
+    """
+    :param uo: ParseResult of a URL
+    :return: The (scheme, hostname) pair of the URL
+    """
+    # hostname is a property that lowercases the netloc on every access,
+    # so compute the pair once per parsed URL
+    return uo.scheme, uo.hostname
+
+
 def normalize_xfo(v: str, o: str) -> str or tuple:
     """
     Normalization of the XFO header according to the Paper
@@ -37,40 +95,55 @@ def normalize_xfo(v: str, o: str) -> str or tuple:
     :param o: Original accessed URL
     :return: Normalized XFO header value
     """
-    if o is not None and o.startswith('//'):
-        o = 'https:' + o
+    return _normalize_xfo(v, _parse_origin(o))
 
-    uo = urlparse(o)
+
+def _normalize_xfo(v: str, uo: ParseResult) -> str or tuple:
+    """
+    Normalization of the XFO header against an already parsed origin
+
+    :param v: Value of the XFO header
+    :param uo: ParseResult of the original accessed URL
+    :return: Normalized XFO header value
+    """
     if not is_valid_origin(uo):
-        print("Invalid origin in call to normalize_xfo for", o)
+        print("Invalid origin in call to normalize_xfo for", uo.geturl())
         return "JUNK"
 
-    v = v.lower()
+    # headers are usually lowercase already, so skip the copy lower() would make
+    if not v.islower():
+        v = v.lower()
     # If only same origin framing is allowed
     if v == "sameorigin":
-        return "SAMEORIGIN", (uo.scheme, uo.hostname)
+        return "SAMEORIGIN", _origin_pair(uo)
     # If framing is denied
     if v == "deny":
         return "DENY"
     # If other origin is whitelisted
-    if v.startswith("allow-from "):
-        tokens = v.split(' ')
-        ue = urlparse(tokens[1])
-        if len(tokens) == 2 and tokens[0] == "allow-from" and is_valid_origin(ue):
-            return "ALLOW-FROM", (ue.scheme, ue.hostname)
-        else:
-            return "ALLOW-JUNK"
+    head, sep, target = v.partition(' ')
+    if head == "allow-from" and sep:
+        # exactly one space followed by a valid origin, anything else is junk
+        if ' ' not in target:
+            ue = _urlparse_cached(target)
+            if is_valid_origin(ue):
+                return "ALLOW-FROM", _origin_pair(ue)
+        return "ALLOW-JUNK"
     return "JUNK"
 
 
 def parse_csp(s: str) -> str or None:
     """
     :param s: Raw CSP header value as string
-    :return: Stripped list of tokens in the CSP string or None
+    :return: Stripped list of lowercase tokens in the CSP string or None
     """
-    if s == 'WARN_NO_HEADER':
+    if s == NO_HEADER:
         return None
-    return s.strip().split()
+    # lowercase the whole header once instead of per token during normalization,
+    # skipping the copy when the header is already lowercase
+    s = s.strip()
+    if not s.islower():
+        s = s.lower()
+    return s.split()
 
 
 def normalize_csp(v: list, o: str) -> str or tuple:
@@ -81,117 +154,142 @@ def normalize_csp(v: list, o: str) -> str or tuple:
     :param o: Original accessed URL
     :return: List of normalized CSP values
     """
+    return _normalize_csp(v, _parse_origin(o))
 
-    if o is not None and o.startswith('//'):
-        o = 'https:' + o
 
-    uo = urlparse(o)
+def _normalize_csp(v: list, uo: ParseResult) -> str or tuple:
+    """
+    Normalization of the CSP header against an already parsed origin
+
+    :param v: List of lowercase values of the CSP header as parse_csp yields them
+    :param uo: ParseResult of the original accessed URL
+    :return: List of normalized CSP values
+    """
     if not is_valid_origin(uo):
-        print("Invalid origin in call to normalize_csp for", o)
+        print("Invalid origin in call to normalize_csp for", uo.geturl())
         return "JUNK"
 
+    origin = _origin_pair(uo)
     nv = []
     for e in v:
-        e = e.lower()
         if e == '*':
             nv.append('*')
         elif e == "\'none\'":
             nv.append('none')
         elif e == "\'self\'":
-            nv.append((uo.scheme, uo.hostname))
+            nv.append(origin)
         elif e == "http:":
             nv.append(("http", "*"))
         elif e == "https:":
             nv.append(("https", "*"))
         else:
-            ue = urlparse(e)
+            ue = _urlparse_cached(e)
             if ue.scheme == '':
-                nv.append((uo.scheme, e))
+                nv.append((origin[0], e))
             else:
-                nv.append((ue.scheme, ue.hostname))
+                nv.append(_origin_pair(ue))
     return nv
 
 
-def t_firefox(p: dict, orig: str) -> list:
+def _xfo_strict(x) -> str or tuple:
     """
-    Semantics of enforcement for Firefox (specification)
+    Enforced expression of a normalized XFO value for browsers honouring ALLOW-FROM
+
+    :param x: Normalized XFO value
+    :return: Enforced expression
+    """
+    if x == "JUNK":
+        return "*"
+    if x == "DENY" or x == "ALLOW-JUNK":
+        return "none"
+    return x[1]
+
+
+def _xfo_lenient(x) -> str or tuple:
+    """
+    Enforced expression of a normalized XFO value for browsers ignoring ALLOW-FROM
+
+    :param x: Normalized XFO value
+    :return: Enforced expression
+    """
+    if x == "JUNK" or x == "ALLOW-JUNK" or x[0] == "ALLOW-FROM":
+        return "*"
+    if x == "DENY":
+        return "none"
+    return x[1]
+
+
+def _translate_policies(p: dict, orig: str, xfo_semantics, use_csp: bool,
+                        split_tokens: bool, combine: bool) -> list:
+    """
+    Shared enforcement engine behind the per-browser translators
 
     :param p: Dictionary of policies
     :param orig: Original url
+    :param xfo_semantics: Maps a normalized XFO value to its enforced expression
+    :param use_csp: Whether the browser enforces CSP frame-ancestors
+    :param split_tokens: Whether XFO headers are split at commas
+    :param combine: Whether all XFO values are combined via meet (else first wins)
     :return: List of enforced values
     """
     pol = {'csp': [], 'xfo': []}
+    uo = _parse_origin(orig)
 
     # Normalization for XFO
-    parsed_xfo = [x.split(',') for x in p['xfo']]
-    parsed_xfo = [y for x in parsed_xfo for y in x]
-    for x in parsed_xfo:
-        px = parse_xfo(x)
-        if px is not None:
-            pol['xfo'].append(normalize_xfo(px, orig))
+    if split_tokens:
+        for tok in _iter_xfo_tokens(p['xfo']):
+            pol['xfo'].append(_normalize_xfo(tok, uo))
+    else:
+        for x in p['xfo']:
+            px = parse_xfo(x)
+            if px is not None:
+                pol['xfo'].append(_normalize_xfo(px, uo))
 
     # Normalization for CSP
-    for c in p['csp']:
-        pc = parse_csp(c)
-        if pc is not None:
-            pol['csp'].append(normalize_csp(pc, orig))
+    if use_csp:
+        for c in p['csp']:
+            pc = parse_csp(c)
+            if pc is not None:
+                pol['csp'].append(_normalize_csp(pc, uo))
 
     if len(pol["csp"]) > 0:
         return pol["csp"][0]
 
     if len(pol["xfo"]) > 0:
-        res = "*"
-        for x in pol["xfo"]:
-            if x == "JUNK":
-                res = meet(res, "*")
-            elif x == "DENY" or x == "ALLOW-JUNK":
-                res = meet(res, "none")
-            else:
-                res = meet(res, x[1])
+        if combine:
+            # repeated values cannot change the meet, so each one is visited once
+            res = "*"
+            for x in dict.fromkeys(pol["xfo"]):
+                res = meet(res, xfo_semantics(x))
+        else:
+            res = xfo_semantics(pol["xfo"][0])
         return [res]
     else:
         return ["*"]
 
 
-def t_chrome(p: dict, orig: str) -> list:
+def t_firefox(p: dict, orig: str) -> list:
     """
-    Semantics of enforcement for Chrome, Chrome for Android, Safari, Safari for iOS, Samsung Internet, UC Browser
+    Semantics of enforcement for Firefox (specification)
 
     :param p: Dictionary of policies
     :param orig: Original url
     :return: List of enforced values
     """
-    pol = {'csp': [], 'xfo': []}
+    return _translate_policies(p, orig, _xfo_strict, use_csp=True,
+                               split_tokens=True, combine=True)
 
-    # Normalization for XFO
-    parsed_xfo = [x.split(',') for x in p['xfo']]
-    parsed_xfo = [y for x in parsed_xfo for y in x]
-    for x in parsed_xfo:
-        px = parse_xfo(x)
-        if px is not None:
-            pol['xfo'].append(normalize_xfo(px, orig))
 
-    # Normalization for CSP
-    for c in p['csp']:
-        pc = parse_csp(c)
-        if pc is not None:
-            pol['csp'].append(normalize_csp(pc, orig))
-
-    if len(pol["csp"]) > 0:
-        return pol["csp"][0]
+def t_chrome(p: dict, orig: str) -> list:
+    """
+    Semantics of enforcement for Chrome, Chrome for Android, Safari, Safari for iOS, Samsung Internet, UC Browser
 
-    if len(pol["xfo"]) > 0:
-        res = "*"
-        for x in pol["xfo"]:
-            if x == "JUNK" or x == "ALLOW-JUNK" or x[0] == "ALLOW-FROM":
-                res = meet(res, "*")
-            elif x == "DENY":
-                res = meet(res, "none")
-            else:
-                res = meet(res, x[1])
-        return [res]
-    else:
-        return ["*"]
+    :param p: Dictionary of policies
+    :param orig: Original url
+    :return: List of enforced values
+    """
+    return _translate_policies(p, orig, _xfo_lenient, use_csp=True,
+                               split_tokens=True, combine=True)
 
 
 def t_opera_mini(p: dict, orig: str) -> list:
@@ -202,26 +300,8 @@ def t_opera_mini(p: dict, orig: str) -> list:
     :param orig: Original url
     :return: List of enforced values
     """
-    pol = {'csp': [], 'xfo': []}
-
-    # Normalization for XFO
-    for x in p['xfo']:
-        px = parse_xfo(x)
-        if px is not None:
-            pol['xfo'].append(normalize_xfo(px, orig))
-
-    if len(pol["xfo"]) > 0:
-        x = pol["xfo"][0]
-
-        if x == "JUNK" or x == "ALLOW-JUNK" or x[0] == "ALLOW-FROM":
-            res = "*"
-        elif x == "DENY":
-            res = "none"
-        else:
-            res = x[1]
-        return [res]
-    else:
-        return ["*"]
+    return _translate_policies(p, orig, _xfo_lenient, use_csp=False,
+                               split_tokens=False, combine=False)
 
 
 def t_edge(p: dict, orig: str) -> list:
@@ -232,35 +312,8 @@ def t_edge(p: dict, orig: str) -> list:
     :param orig: Original url
     :return: List of enforced values
     """
-    pol = {'csp': [], 'xfo': []}
-
-    # Normalization for CSP
-    for c in p['csp']:
-        pc = parse_csp(c)
-        if pc is not None:
-            pol['csp'].append(normalize_csp(pc, orig))
-
-    # Normalization for XFO
-    for x in p['xfo']:
-        px = parse_xfo(x)
-        if px is not None:
-            pol['xfo'].append(normalize_xfo(px, orig))
-
-    if len(pol["csp"]) > 0:
-        return pol["csp"][0]
-
-    if len(pol["xfo"]) > 0:
-        x = pol["xfo"][0]
-
-        if x == "JUNK":
-            res = "*"
-        elif x == "DENY" or x == "ALLOW-JUNK":
-            res = "none"
-        else:
-            res = x[1]
-        return [res]
-    else:
-        return ["*"]
+    return _translate_policies(p, orig, _xfo_strict, use_csp=True,
+                               split_tokens=False, combine=False)
 
 
 def t_explorer(p: dict, orig: str) -> list:
@@ -271,26 +324,25 @@ def t_explorer(p: dict, orig: str) -> list:
     :param orig: Original url
     :return: List of enforced values
     """
-    pol = {'csp': [], 'xfo': []}
+    return _translate_policies(p, orig, _xfo_strict, use_csp=False,
+                               split_tokens=False, combine=False)
 
-    # Normalization for XFO
-    for x in p['xfo']:
-        px = parse_xfo(x)
-        if px is not None:
-            pol['xfo'].append(normalize_xfo(px, orig))
 
-    if len(pol["xfo"]) > 0:
-        x = pol["xfo"][0]
+# Dispatch from User-Agent string to the matching enforcement semantics
+_UA_DISPATCH = {
+    FIREFOX_UA: t_firefox,
+    CHROME_UA: t_chrome,
+    SAFARI_UA: t_chrome,
+    SAFARI_IOS_UA: t_chrome,
+    SAMSUNG_UA: t_chrome,
+    UC_UA: t_chrome,
+    IE_UA: t_explorer,
+    OPERA_MINI_UA: t_opera_mini,
+    EDGE_UA: t_edge,
+}
 
-        if x == "JUNK":
-            res = "*"
-        elif x == "DENY" or x == "ALLOW-JUNK":
-            res = "none"
-        else:
-            res = x[1]
-        return [res]
-    else:
-        return ["*"]
+# Browsers that only enforce XFO and ignore CSP frame-ancestors
+_JUST_XFO_UAS = frozenset([IE_UA, OPERA_MINI_UA])
 
 
 def translate(p: dict, b: str, orig: str) -> list:
@@ -300,24 +352,11 @@ def translate(p: dict, b: str, orig: str) -> list:
     :param orig: Original URL
     :return:
     """
-    if b == "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:67.0) Gecko/20100101 Firefox/67.0":
-        return t_firefox(p, orig)
-    if b in [
-        "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/77.0.3865.75 Safari/537.36",
-        "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_14_4) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/12.1 Safari/605.1.15",
-        "Mozilla/5.0 (iPhone; CPU iPhone OS 12_4 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/12.1.2 Mobile/15E148 Safari/604.1",
-        "Mozilla/5.0 (Linux; Android 9; SAMSUNG SM-G960U Build/PPR1.180610.011) AppleWebKit/537.36 (KHTML, like Gecko) SamsungBrowser/9.4 Chrome/67.0.3396.87 Mobile Safari/537.36",
-        "Mozilla/5.0 (Linux; U; Android 7.0; es-LA; Moto C Build/NRD90M.068) AppleWebKit/537.36 (KHTML, like Gecko) Version/4.0 Chrome/57.0.2987.108 UCBrowser/12.9.5.1146 Mobile Safari/537.36"]:
-        return t_chrome(p, orig)
-    if b == "Mozilla/5.0 (Windows NT 6.1; WOW64; Trident/7.0; rv:11.0) like Gecko":
-        return t_explorer(p, orig)
-    if b == "Opera/9.80 (Android; Opera Mini/12.0.1987/37.7327; U; pl) Presto/2.12.423 Version/12.16":
-        return t_opera_mini(p, orig)
-    if b == "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/64.0.3282.140 Safari/537.36 Edge/18.17763":
-        return t_edge(p, orig)
-    else:
+    handler = _UA_DISPATCH.get(b)
+    if handler is None:
         print("Unsupported browser in call to translate!")
         sys.exit()
+    return handler(p, orig)
 
 
 def leq_host(h1: str, h2: str) -> bool:
@@ -332,15 +371,13 @@ def leq_host(h1: str, h2: str) -> bool:
         return True
     if h1 == '*':
         return False
-    tokens1 = h1.split('.')
-    tokens2 = h2.split('.')
-    if tokens1[0] == '*':
-        return tokens2[0] == '*' and h1.endswith('.' + '.'.join(tokens2[1:]))
-    elif tokens2[0] == '*':
-        return h1.endswith('.' + '.'.join(tokens2[1:]))
+    # only a wildcard host can still subsume h1; h2[1:] keeps the leading dot
+    if h2.startswith('*.'):
+        return h1.endswith(h2[1:])
     return False
 
 
+@functools.lru_cache(maxsize=8192)
 def leq_exp(e1: str, e2: str) -> bool:
     """
     :param e1: Value for Expression A
@@ -366,22 +403,35 @@ def leq_val(v1: list, v2: list) -> bool:
     :param v2: List of expressions B
     :return: Equality match
     """
+    # duplicate expressions cannot change the outcome, so compare each one once
+    v1 = dict.fromkeys(v1)
+    v2 = list(dict.fromkeys(v2))
     for e1 in v1:
-        found = False
-        for e2 in v2:
-            if leq_exp(e1, e2):
-                found = True
-        if not found:
+        if not any(leq_exp(e1, e2) for e2 in v2):
             return False
     return True
 
 
+# The only non-tuple expressions meet ever sees are the lattice top and bottom,
+# so their combinations can be resolved by table instead of through leq_exp
+_MEET_TABLE = {
+    ('*', '*'): '*',
+    ('*', 'none'): 'none',
+    ('none', '*'): 'none',
+    ('none', 'none'): 'none',
+}
+
+
+@functools.lru_cache(maxsize=8192)
 def meet(e1: str, e2: str) -> str:
     """
     :param e1: Value for Expression A
     :param e2: Value for Expression B
     :return: Meeting Value
     """
+    res = _MEET_TABLE.get((e1, e2))
+    if res is not None:
+        return res
     if leq_exp(e1, e2):
         return e1
     if leq_exp(e2, e1):
@@ -394,8 +444,7 @@ def just_xfo(b: str) -> bool:
     :param b: User-Agent string
     :return: true if only XFO is supported else false
     """
-    return b in ["Mozilla/5.0 (Windows NT 6.1; WOW64; Trident/7.0; rv:11.0) like Gecko",
-                 "Opera/9.80 (Android; Opera Mini/12.0.1987/37.7327; U; pl) Presto/2.12.423 Version/12.16"]
+    return b in _JUST_XFO_UAS
 
 
 def find_inconsistencies(p: dict, orig: str) -> dict:
@@ -410,30 +459,39 @@ def find_inconsistencies(p: dict, orig: str) -> dict:
     b_xfo = []
     b_csp = []
 
+    # interned keys make the UA dispatch and frozenset lookups identity checks
+    p = {sys.intern(b): v for b, v in p.items()}
+
     for b in p:
         if just_xfo(b):
             b_xfo.append(b)
         else:
             b_csp.append(b)
 
+    # browsers sharing a translator and identical headers enforce identically,
+    # so translate each (translator, headers) combination only once
+    translated = {}
     for b in b_xfo + b_csp:
 
-        v = translate(p[b], b, orig)
+        handler = _UA_DISPATCH.get(b)
+        cache_key = (handler, tuple(p[b].get('xfo', ())), tuple(p[b].get('csp', ())))
+        if handler is not None and cache_key in translated:
+            v = translated[cache_key]
+        else:
+            v = translate(p[b], b, orig)
+            translated[cache_key] = v
 
         if just_xfo(b):
             key = "xfo"
         else:
             key = "csp"
 
-        semantics[key].append(v)
+        # tuples are hashable, so duplicates can be removed with a dict below
+        semantics[key].append(tuple(v))
 
-    # remove duplicates
-    no_dup_xfo = []
-    [no_dup_xfo.append(x) for x in semantics["xfo"] if x not in no_dup_xfo]
-    no_dup_csp = []
-    [no_dup_csp.append(x) for x in semantics["csp"] if x not in no_dup_csp]
-    semantics["xfo"] = no_dup_xfo
-    semantics["csp"] = no_dup_csp
+    # remove duplicates while preserving insertion order
+    semantics["xfo"] = list(dict.fromkeys(semantics["xfo"]))
+    semantics["csp"] = list(dict.fromkeys(semantics["csp"]))
 
     return semantics
 
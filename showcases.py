@@ -1,35 +1,73 @@
-from libanalyzer import *
+from concurrent.futures import ProcessPoolExecutor
 
-FIREFOX = "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:67.0) Gecko/20100101 Firefox/67.0"
-CHROME = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) " \
-         "Chrome/77.0.3865.75 Safari/537.36"
-IE = "Mozilla/5.0 (Windows NT 6.1; WOW64; Trident/7.0; rv:11.0) like Gecko"
-OPERA_MINI = "Opera/9.80 (Android; Opera Mini/12.0.1987/37.7327; U; pl) Presto/2.12.423 Version/12.16"
-EDGE = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) " \
-       "Chrome/64.0.3282.140 Safari/537.36 Edge/18.17763"
+from libanalyzer import *
 
-NO_HEADER = "WARN_NO_HEADER"
+FIREFOX = FIREFOX_UA
+CHROME = CHROME_UA
+IE = IE_UA
+OPERA_MINI = OPERA_MINI_UA
+EDGE = EDGE_UA
 
 
-def analyze(site: str, data: dict) -> None:
+def _status(site: str, data: dict) -> str:
     """
-    Main analytics functionality
+    Computes the consistency verdict for one site
 
     :param site: The Origin of the deploying site
     :param data: Collected data (user-agent & policies)
-    :return: Nothing, it only prints results
+    :return: Status line for the site
     """
     inc = find_inconsistencies(data, site)
-    print('~~ Investigating:', site)
     if is_inconsistent(inc):
         if is_sec_oriented(inc):
-            print('Status: SecurityOriented', inc)
+            return 'Status: SecurityOriented ' + str(inc)
         elif is_comp_oriented(inc):
-            print('Status: CompatibilityOriented:', inc)
+            return 'Status: CompatibilityOriented: ' + str(inc)
         else:
-            print('Status: Inconstancy:', inc)
+            return 'Status: Inconstancy: ' + str(inc)
+    else:
+        return 'Status: Consistent'
+
+
+def _status_entry(item: tuple) -> tuple:
+    """
+    Picklable worker entry point for the parallel bulk analysis
+
+    :param item: Pair of site origin and collected data
+    :return: Pair of site origin and its status line
+    """
+    site, data = item
+    return site, _status(site, data)
+
+
+def analyze(site: str, data: dict) -> None:
+    """
+    Main analytics functionality
+
+    :param site: The Origin of the deploying site
+    :param data: Collected data (user-agent & policies)
+    :return: Nothing, it only prints results
+    """
+    print('~~ Investigating:', site)
+    print(_status(site, data))
+
+
+def analyze_bulk(datasets: dict, workers: int = None) -> None:
+    """
+    Runs the analysis for a whole corpus of sites in one go
+
+    :param datasets: Mapping from site origin to collected data
+    :param workers: Number of worker processes, analyze sequentially if None
+    :return: Nothing, it only prints results
+    """
+    if workers is not None and workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for site, status in pool.map(_status_entry, datasets.items()):
+                print('~~ Investigating:', site)
+                print(status)
     else:
-        print('Status: Consistent')
+        for site, data in datasets.items():
+            analyze(site, data)
 
 
 def main():